@@ -3,16 +3,20 @@
 PC-side logger for Arduino lick events.
 - Reads serial lines at 9600 baud (configurable).
 - Extracts timestamps for lick events from lines containing the token: '\tlick\t'
+  (another event name can be logged with --token, e.g. --token poke)
 - Writes to CSV with columns: timestamp_ms, lick_number
 - Rotates to a new CSV every N minutes (configurable).
+- Can instead convert a previously captured raw serial log (--replay).
 Usage:
   python pc_lick_logger.py --port /dev/ttyACM0 --baud 9600 --minutes 15 --dir ./logs
+  python pc_lick_logger.py --replay capture.txt --dir ./logs
 """
 import argparse
-import csv
 import os
-import re
+import queue
+import selectors
 import sys
+import threading
 import time
 from datetime import datetime, timedelta
 
@@ -23,7 +27,16 @@ except Exception as e:
     print("ERROR: pyserial not installed. Install with: pip install pyserial", file=sys.stderr)
     raise
 
-LICK_RE = re.compile(r'(\d+)\tlick\t')
+DEFAULT_EVENT = "lick"
+
+# Rows are buffered and written in batches: every FLUSH_ROWS rows or
+# FLUSH_SECS seconds, whichever comes first.
+FLUSH_ROWS = 32
+FLUSH_SECS = 1.0
+
+# Licks waiting for the writer thread; beyond this they are dropped
+# rather than blocking serial reads.
+QUEUE_SIZE = 4096
 
 def suggest_ports():
     ports = list(list_ports.comports())
@@ -38,11 +51,119 @@ def open_csv(log_dir):
     os.makedirs(log_dir, exist_ok=True)
     stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     fname = os.path.join(log_dir, f"licks_{stamp}.csv")
-    f = open(fname, "w", newline="", encoding="utf-8")
-    w = csv.writer(f)
-    w.writerow(["timestamp_ms", "lick_number"])
+    f = open(fname, "w", newline="", encoding="utf-8", buffering=1 << 16)
+    f.write("timestamp_ms,lick_number\r\n")
     print(f"[logger] Writing to {fname}")
-    return f, w, time.time()
+    return f, time.monotonic()
+
+def event_token(event):
+    return b"\t" + event.encode("utf-8") + b"\t"
+
+def make_event_parser(event=DEFAULT_EVENT):
+    """Build a parser returning the timestamp (ms) of `event` in a raw line, or None.
+
+    Example line: b"<...>\\t123456\\tlick\\t<...>". The timestamp is the
+    tab-separated field right before the token. The function is generated
+    once at startup with the token baked in as a constant, and works on
+    bytes so lines without the event are rejected without being decoded.
+    """
+    src = (
+        "def parse_event(line):\n"
+        f"    idx = line.find({event_token(event)!r})\n"
+        "    if idx < 0:\n"
+        "        return None\n"
+        "    ts = line[:idx].rsplit(b'\\t', 1)[-1].lstrip()\n"
+        "    if not ts.isdigit():\n"
+        "        return None\n"
+        "    return int(ts)\n"
+    )
+    ns = {}
+    exec(compile(src, f"<parse_{event}>", "exec"), ns)
+    return ns["parse_event"]
+
+def csv_writer_worker(q, args, csv_file, opened_at):
+    """Write (lick_ts, lick_count) items from q in batches, rotating files.
+
+    Runs in a background thread and owns the CSV file, so a slow disk
+    never blocks serial reads. A None item closes the file and returns.
+    """
+    rotate_after = args.minutes * 60.0
+    rotate_deadline = opened_at + rotate_after
+    pending = []
+    echo = []
+    last_flush = time.monotonic()
+
+    def flush_pending():
+        nonlocal last_flush
+        if pending:
+            csv_file.write("".join(pending))
+            pending.clear()
+            csv_file.flush()
+            if args.safe:
+                os.fsync(csv_file.fileno())
+        if echo:
+            sys.stdout.write("".join(echo))
+            sys.stdout.flush()
+            echo.clear()
+        last_flush = time.monotonic()
+
+    def close_csv():
+        flush_pending()
+        if args.fsync_on_rotate:
+            os.fsync(csv_file.fileno())
+        csv_file.close()
+
+    while True:
+        try:
+            item = q.get(timeout=max(0.0, min(FLUSH_SECS, rotate_deadline - time.monotonic())))
+        except queue.Empty:
+            pass
+        else:
+            if item is None:
+                break
+            # CSV line with the \r\n terminator used by the header
+            pending.append(f"{item[0]},{item[1]}\r\n")
+            if args.verbose:
+                echo.append(f"LICK #{item[1]} @ {item[0]} ms\n")
+
+        now = time.monotonic()
+        if pending and (args.flush_every_row or args.safe or len(pending) >= FLUSH_ROWS
+                        or (now - last_flush) >= FLUSH_SECS):
+            flush_pending()
+
+        # rotation check
+        if now >= rotate_deadline:
+            try:
+                close_csv()
+            except Exception:
+                pass
+            csv_file, opened_at = open_csv(args.dir)
+            rotate_deadline = opened_at + rotate_after
+
+    # Only reached through the None sentinel: on errors the exception
+    # propagates as is and the file is left to the interpreter
+    close_csv()
+
+def replay(path, log_dir, event=DEFAULT_EVENT):
+    """Convert a raw serial capture into a single lick CSV."""
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except OSError as e:
+        print(f"Could not read replay file {path}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    # Same parser as live capture; the C-level `in` test skips most lines
+    # before any Python call is made.
+    token = event_token(event)
+    parse = make_event_parser(event)
+    stamps = [parse(line) for line in data.splitlines() if token in line]
+    stamps = [ts for ts in stamps if ts is not None]
+
+    csv_file, _ = open_csv(log_dir)
+    with csv_file:
+        csv_file.write("".join([f"{ts},{n}\r\n" for n, ts in enumerate(stamps, 1)]))
+    print(f"[logger] Replayed {len(stamps)} licks from {path}")
 
 def main():
     ap = argparse.ArgumentParser()
@@ -50,7 +171,19 @@ def main():
     ap.add_argument("--baud", type=int, default=9600, help="Baud rate")
     ap.add_argument("--minutes", type=int, default=15, help="Rotation interval in minutes")
     ap.add_argument("--dir", default="logs", help="Directory to store CSV files")
+    ap.add_argument("--flush-every-row", action="store_true", help="Write and flush each lick immediately instead of batching")
+    ap.add_argument("--fsync-on-rotate", action="store_true", help="fsync each CSV to disk before closing it")
+    ap.add_argument("--safe", action="store_true", help="Write, flush and fsync every lick (slowest, most durable)")
+    ap.add_argument("--token", default=DEFAULT_EVENT, help="Event name to log, as printed between tabs by the Arduino (default: lick)")
+    ap.add_argument("--verbose", action="store_true", help="Echo each lick to the console (printed once per CSV batch)")
+    ap.add_argument("--replay", metavar="FILE", default=None, help="Convert a raw serial capture to CSV instead of reading a port")
     args = ap.parse_args()
+    if not args.token or any(c.isspace() for c in args.token):
+        ap.error("--token must be a non-empty name without whitespace")
+
+    if args.replay is not None:
+        replay(args.replay, args.dir, args.token)
+        return
 
     if args.port is None:
         # Try to pick the first Arduino-like port
@@ -67,52 +200,56 @@ def main():
         print(f"Could not open serial port {args.port}: {e}\n" + suggest_ports(), file=sys.stderr)
         sys.exit(2)
 
-    csv_file, writer, opened_at = open_csv(args.dir)
+    # On POSIX, wait on the port's file descriptor so we only wake up for
+    # data or rotation. Windows ports have no selectable fileno() and rely
+    # on the blocking read timeout instead.
+    sel = selectors.DefaultSelector()
+    try:
+        sel.register(ser.fileno(), selectors.EVENT_READ)
+    except (AttributeError, OSError, ValueError):
+        sel.close()
+        sel = None
+
+    parse = make_event_parser(args.token)
+    csv_file, opened_at = open_csv(args.dir)
+    q = queue.Queue(maxsize=QUEUE_SIZE)
+    worker = threading.Thread(target=csv_writer_worker, args=(q, args, csv_file, opened_at), daemon=True)
+    worker.start()
     lick_count = 0
-    rotate_after = args.minutes * 60.0
+    dropped = 0
 
     print("[logger] Listening... Press Ctrl+C to stop.")
     try:
         buf = b""
-        while True:
-            line = ser.readline()
-            if not line:
-                # small sleep to avoid busy loop
-                time.sleep(0.01)
-                # check rotation even if no lines
-            else:
-                try:
-                    s = line.decode("utf-8", errors="replace").strip()
-                except Exception:
-                    s = str(line)
-                # Example line contains:  "<...>\t123456\tlick\t<...>"
-                m = LICK_RE.search(s)
-                if m:
-                    lick_ts = int(m.group(1))
+        while worker.is_alive():
+            if sel is None or sel.select(1.0):
+                # Drain everything the driver has queued in one read (without a
+                # selector this blocks up to the serial timeout for 1 byte)
+                buf += ser.read(max(ser.in_waiting, 1))
+            # Split complete lines locally; keep any partial tail for later
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                lick_ts = parse(line)
+                if lick_ts is not None:
+                    # keep lick_count continuous across files
                     lick_count += 1
-                    writer.writerow([lick_ts, lick_count])
-                    csv_file.flush()
-                    # Optional console echo:
-                    print(f"LICK #{lick_count} @ {lick_ts} ms")
-
-            # rotation check
-            if (time.time() - opened_at) >= rotate_after:
-                try:
-                    csv_file.flush()
-                    csv_file.close()
-                except Exception:
-                    pass
-                csv_file, writer, opened_at = open_csv(args.dir)
-                # keep lick_count continuous across files
+                    try:
+                        q.put_nowait((lick_ts, lick_count))
+                    except queue.Full:
+                        dropped += 1
+                        if dropped == 1:
+                            print("[logger] WARNING: disk is falling behind, dropping licks", file=sys.stderr)
+        print(f"[logger] ERROR: CSV writer stopped; {q.qsize()} queued licks were not written", file=sys.stderr)
+        sys.exit(1)
 
     except KeyboardInterrupt:
         print("\n[logger] Stopping...")
     finally:
-        try:
-            csv_file.flush()
-            csv_file.close()
-        except Exception:
-            pass
+        if worker.is_alive():
+            q.put(None)
+            worker.join()
+        if dropped:
+            print(f"[logger] Dropped {dropped} licks while the disk was busy", file=sys.stderr)
         try:
             ser.close()
         except Exception:
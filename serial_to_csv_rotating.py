@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 import argparse
-import csv
 import os
+import selectors
 import sys
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 
 try:
     import serial
@@ -13,42 +13,57 @@ except Exception:
     print("ERROR: Necesitas instalar pyserial:  pip install pyserial", file=sys.stderr)
     raise
 
+# Las filas se escriben por lotes: cada BATCH_ROWS filas o BATCH_SECS segundos.
+BATCH_ROWS = 64
+BATCH_SECS = 2.0
+
 def guess_port():
-    ports = list(list_ports.comports())
-    ports.sort(key=lambda p: (("ACM" not in p.device), ("USB" not in p.device), p.device))
-    return [p.device for p in ports]
+    # Preferencia: ACM (Arduino nativo), luego USB (adaptadores), luego el resto
+    acm, usb, rest = [], [], []
+    for p in list_ports.comports():
+        dev = p.device
+        if "ACM" in dev:
+            acm.append(dev)
+        elif "USB" in dev:
+            usb.append(dev)
+        else:
+            rest.append(dev)
+    return sorted(acm) + sorted(usb) + sorted(rest)
 
 def open_serial(port, baud):
     return serial.Serial(port, baudrate=baud, timeout=1)
 
-def parse_line(line):
-    # Espera: "<timestamp_ms> <cadena>"
-    if not line:
-        return None, None
-    line = line.strip()
-    if not line:
-        return None, None
-    parts = line.split(None, 1)
-    if len(parts) != 2:
-        return None, None
-    ts_str, cadena = parts
-    # validar número
-    try:
-        float(ts_str)
-    except Exception:
-        return None, None
-    return ts_str, cadena
-
-def new_csv_writer(outdir):
-    ts = datetime.now()
-    fname = ts.strftime("log_%Y%m%d_%H%M%S.csv")
+def make_line_parser(sep=None):
+    # Genera parse_line una sola vez con el separador fijado como constante.
+    # Espera: b"<timestamp_ms><sep><cadena>" (bytes tal cual llegan del serial);
+    # sep=None separa por cualquier espacio en blanco.
+    sep_b = None if sep is None else sep.encode("utf-8")
+    src = (
+        "def parse_line(raw):\n"
+        "    if not raw:\n"
+        "        return None, None\n"
+        f"    parts = raw.rstrip(b'\\r\\n\\t ').split({sep_b!r}, 1)\n"
+        "    if len(parts) != 2:\n"
+        "        return None, None\n"
+        "    ts, cadena = parts\n"
+        + ("" if sep is None else "    ts = ts.strip()\n") +
+        "    # validar número (timestamp_ms es entero)\n"
+        "    if not ts.isdigit():\n"
+        "        return None, None\n"
+        "    return ts.decode('ascii'), cadena.decode('utf-8', errors='replace')\n"
+    )
+    ns = {}
+    exec(compile(src, "<parse_line>", "exec"), ns)
+    return ns["parse_line"]
+
+def new_csv_file(outdir):
+    fname = datetime.now().strftime("log_%Y%m%d_%H%M%S.csv")
     fpath = os.path.join(outdir, fname)
-    f = open(fpath, "w", newline="", encoding="utf-8")
-    writer = csv.writer(f)
-    writer.writerow(["iso_time", "device_timestamp_ms", "cadena"])
+    f = open(fpath, "w", newline="", encoding="utf-8", buffering=1 << 16)
+    f.write("iso_time,device_timestamp_ms,cadena\r\n")
     f.flush()
     print(f"[+] Nuevo archivo: {fpath}")
-    return f, writer, ts
+    return f
 
 def main():
     ap = argparse.ArgumentParser(description="Leer Arduino por Serial y guardar CSV rotando cada N minutos.")
@@ -56,8 +71,20 @@ def main():
     ap.add_argument("--baud", "-b", type=int, default=115200, help="Baudrate (default: 115200).")
     ap.add_argument("--outdir", "-d", required=True, help="Directorio de salida para los CSV.")
     ap.add_argument("--period-min", "-m", type=float, default=2.0, help="Minutos por archivo (default: 2).")
-    ap.add_argument("--show", action="store_true", help="Imprime en consola cada fila válida.")
+    ap.add_argument("--sep", "-s", default=None, help="Separador entre timestamp y cadena (default: cualquier espacio; admite \\t).")
+    ap.add_argument("--show", action="store_true", help="Imprime en consola cada fila válida (por lotes, al escribir el CSV).")
+    ap.add_argument("--fsync-on-rotate", action="store_true", help="Hace fsync de cada CSV antes de cerrarlo.")
+    ap.add_argument("--safe", action="store_true", help="Escribe, hace flush y fsync en cada fila (más lento, más seguro).")
     args = ap.parse_args()
+    sep = args.sep
+    if sep is not None:
+        # Interpretar escapes como \t sin estropear caracteres no ASCII
+        try:
+            sep = sep.encode("latin-1", "backslashreplace").decode("unicode_escape")
+        except UnicodeDecodeError:
+            ap.error(f"--sep no válido: {args.sep!r}")
+    if sep == "":
+        ap.error("--sep no puede estar vacío")
 
     # Detectar puerto si no se especifica
     port = args.port
@@ -81,45 +108,92 @@ def main():
         print(f"No se pudo abrir el puerto {port}: {e}", file=sys.stderr)
         sys.exit(1)
 
+    # En POSIX se espera sobre el descriptor del puerto (sin sondeo);
+    # en Windows no hay fileno() seleccionable y se bloquea en read().
+    sel = selectors.DefaultSelector()
+    try:
+        sel.register(ser.fileno(), selectors.EVENT_READ)
+    except (AttributeError, OSError, ValueError):
+        sel.close()
+        sel = None
+
+    parse = make_line_parser(sep)
+
     # Crear primer CSV
-    f, writer, created_at = new_csv_writer(outdir)
-    rotate_after = created_at + timedelta(minutes=args.period_min)
+    f = new_csv_file(outdir)
+    rotate_after = args.period_min * 60.0
+    rotate_deadline = time.monotonic() + rotate_after
+    pending = []
+    shown = []
+    last_flush = time.monotonic()
+    # iso_time sólo cambia una vez por segundo: se cachea el texto
+    iso_now, iso_sec = "", 0
+
+    def flush_pending():
+        nonlocal last_flush
+        if pending:
+            f.write("".join(pending))
+            f.flush()
+            pending.clear()
+            if args.safe:
+                os.fsync(f.fileno())
+        if shown:
+            sys.stdout.write("".join(shown))
+            sys.stdout.flush()
+            shown.clear()
+        last_flush = time.monotonic()
+
+    def close_csv():
+        flush_pending()
+        if args.fsync_on_rotate:
+            os.fsync(f.fileno())
+        f.close()
 
     print(f"Grabando en {outdir}. Rotación cada {args.period_min} min. Ctrl+C para salir.")
     try:
+        buf = b""
         while True:
             try:
-                raw = ser.readline()
+                # Dormir en el SO hasta que haya datos o toque rotar
+                if sel is None or sel.select(min(1.0, max(0.0, rotate_deadline - time.monotonic()))):
+                    # Vaciar de una vez lo acumulado por el driver
+                    buf += ser.read(max(ser.in_waiting, 1))
             except serial.SerialException as e:
                 print(f"Error de lectura serial: {e}", file=sys.stderr)
                 time.sleep(0.5)
-                continue
-
-            if not raw:
-                # timeout
-                pass
-            else:
-                try:
-                    line = raw.decode("utf-8", errors="replace").strip()
-                except Exception:
-                    line = raw.decode("latin1", errors="replace").strip()
+                # Sin continue: las filas pendientes se siguen escribiendo y
+                # rotando aunque el puerto falle (ej. Arduino desconectado)
+            # Separar líneas completas; el resto queda para la próxima lectura
+            *lines, buf = buf.split(b"\n")
 
-                ts_str, cadena = parse_line(line)
+            for raw in lines:
+                ts_str, cadena = parse(raw)
                 if ts_str is not None:
-                    row = [datetime.now().isoformat(timespec="seconds"), ts_str, cadena]
-                    writer.writerow(row)
-                    f.flush()
+                    now_s = int(time.time())
+                    if now_s != iso_sec:
+                        iso_now = datetime.fromtimestamp(now_s).isoformat(timespec="seconds")
+                        iso_sec = now_s
                     if args.show:
-                        print(",".join(row))
+                        shown.append(f"{iso_now},{ts_str},{cadena}\n")
+                    if "," in cadena or '"' in cadena or "\r" in cadena:
+                        # Necesita comillas, igual que csv.QUOTE_MINIMAL
+                        cadena = '"' + cadena.replace('"', '""') + '"'
+                    # Línea CSV con el mismo terminador \r\n que la cabecera
+                    pending.append(f"{iso_now},{ts_str},{cadena}\r\n")
+
+            now = time.monotonic()
+            if pending and (args.safe or len(pending) >= BATCH_ROWS
+                            or now - last_flush >= BATCH_SECS):
+                flush_pending()
 
             # ¿Toca rotar?
-            if datetime.now() >= rotate_after:
+            if now >= rotate_deadline:
                 try:
-                    f.close()
+                    close_csv()
                 except Exception:
                     pass
-                f, writer, created_at = new_csv_writer(outdir)
-                rotate_after = created_at + timedelta(minutes=args.period_min)
+                f = new_csv_file(outdir)
+                rotate_deadline = time.monotonic() + rotate_after
 
     except KeyboardInterrupt:
         print("\nCerrando...")
@@ -129,7 +203,7 @@ def main():
         except Exception:
             pass
         try:
-            f.close()
+            close_csv()
         except Exception:
             pass
 